@@ -1,8 +1,7 @@
 import dash
-from dash import dcc, html, Input, Output
-import plotly.graph_objects as go
+from dash import dcc, html, Input, Output, State
+import plotly.io as pio
 import pandas as pd
-import geopandas as gpd
 import numpy as np
 import os
 
@@ -11,23 +10,215 @@ app = dash.Dash(__name__,
                 meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
                 external_stylesheets=['https://fonts.googleapis.com/css2?family=Open+Sans:wght@300;400;600&display=swap'])
 
+# Dash serializes callback outputs and the layout through Plotly's JSON
+# encoder; use orjson there instead of the stdlib json module
+pio.json.config.default_engine = "orjson"
+
 # Define server variable - this is what Render will use
 server = app.server
 
 # Make sure the data path is correctly handled
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-data_path = os.path.join(BASE_DIR, "data", "results_gdf.pkl")
+# Flat table written by prepare_data.py from data/results_gdf.pkl
+data_path = os.path.join(BASE_DIR, "data", "results.feather")
+
+# Hover label for each value of the precomputed 'sign' column
+SIGN_LABELS = [(-1, 'Decrease'), (1, 'Increase'), (0, 'No Change')]
+
+def prepare_city_frame(data):
+    """Sort one city's points and add the columns make_plot needs."""
+    data = data.sort_values(by="tree_cover_change")
+    # Roughly square grid, but never narrower than 20 columns
+    n = len(data)
+    n_cols = max(20, int(np.ceil(np.sqrt(n))))
+    idx = np.arange(n, dtype=np.int32)
+    data['x_coord'] = idx % n_cols
+    data['y_coord'] = -(idx // n_cols)
+    tcc = data['tree_cover_change'].to_numpy()
+    data['marker_size'] = np.where(tcc == 0, np.float32(0.1), np.abs(tcc) * np.float32(0.5))
+    data['sign'] = np.sign(tcc).astype(np.int8)
+    return data
+
+# Map pyramid: each level averages points into cells `level` times the size
+# of the 500 m source grid. A city is drawn at the finest level that keeps it
+# under MAX_MAP_POINTS markers.
+MAP_LEVELS = (1, 2, 4)
+MAX_MAP_POINTS = 20000
+# Width of one 500 m Web Mercator cell in degrees of longitude
+CELL_SIZE_DEG = 500 / 111320
+# Same colours as the source data uses for each direction of change
+INCREASE_COLOR = '#24D29B'
+DECREASE_COLOR = '#F4A3F3'
+
+def aggregate_points(data, level):
+    """Average a city's points into coarser cells for one map pyramid level."""
+    lat = data['lat'].to_numpy()
+    lon = data['lon'].to_numpy()
+    res_lon = CELL_SIZE_DEG * level
+    # Mercator cells shrink in latitude by cos(lat)
+    res_lat = res_lon * np.cos(np.radians(lat.mean()))
+    cells = [np.floor(lat / res_lat), np.floor(lon / res_lon)]
+    agg = data.groupby(cells)[['lat', 'lon', 'tree_cover_change', 'tree_cover_2002', 'tree_cover_2022']].mean()
+    agg = agg.reset_index(drop=True)
+    tcc = agg['tree_cover_change'].to_numpy()
+    agg['markersize'] = np.abs(tcc) * 0.5
+    agg['color'] = np.where(tcc < 0, DECREASE_COLOR, INCREASE_COLOR)
+    agg['sign'] = np.sign(tcc).astype(np.int8)
+    return agg
+
+def map_frame(city):
+    """Return the finest pyramid level of a city within MAX_MAP_POINTS."""
+    data = CITY_FRAMES[city]
+    for level in MAP_LEVELS:
+        frame = data if level == 1 else aggregate_points(data, level)
+        if len(frame) <= MAX_MAP_POINTS:
+            break
+    return frame
+
+def hover_fields(label, color):
+    """Hover template and label styling shared by every trace."""
+    return dict(
+        hovertemplate=(
+            "<span style='color:white'>Type: " + label + "<br>" +
+            "Change: %{customdata[0]:.2f} %<br>" +
+            "2002: %{customdata[1]:.2f} %<br>" +
+            "2022: %{customdata[2]:.2f} %</span><extra></extra>"
+        ),
+        hoverlabel=dict(
+            bgcolor=color,
+            bordercolor='rgba(255,255,255,1.0)',
+        ),
+    )
+
+def hover_customdata(data):
+    """Stack the hover values into a plain float32 array for Plotly."""
+    return np.column_stack([
+        data['tree_cover_change'].to_numpy(),
+        data['tree_cover_2002'].to_numpy(),
+        data['tree_cover_2022'].to_numpy(),
+    ]).astype(np.float32, copy=False)
 
 # Use a try-except block to help debug data loading issues
 try:
-    results_gdf = pd.read_pickle(data_path)
+    results_df = pd.read_feather(data_path)
+    # Narrow dtypes: a few repeated strings and floats that don't need 64 bits
+    for col in ('location', 'color'):
+        results_df[col] = results_df[col].astype('category')
+    for col in ('markersize', 'tree_cover_change', 'tree_cover_2002', 'tree_cover_2022', 'lat', 'lon'):
+        results_df[col] = results_df[col].astype('float32')
     # Get list of available cities
-    cities = sorted(results_gdf["location"].unique())
+    cities = sorted(results_df["location"].unique())
+    # Split by city once so callbacks only do a dict lookup
+    CITY_FRAMES = {
+        city: prepare_city_frame(sub)
+        for city, sub in results_df.groupby("location", sort=False, observed=True)
+    }
 except Exception as e:
     print(f"Error loading data: {e}")
     # Provide a fallback to prevent app from crashing if data isn't found
-    results_gdf = pd.DataFrame()
+    results_df = pd.DataFrame()
+    CITY_FRAMES = {}
     cities = ["No data available"]
+
+def make_plot(city, mode):
+    data = CITY_FRAMES[city]
+
+    if mode == 'map':
+        data = map_frame(city)
+        lat = data['lat'].to_numpy()
+        lon = data['lon'].to_numpy()
+        markersize = data['markersize'].to_numpy()
+        colors = data['color'].astype(str).to_numpy()
+        customdata = hover_customdata(data)
+        sign = data['sign'].to_numpy()
+
+        traces = []
+
+        # One trace per change type so the hover label can name it directly
+        for sign_value, label in SIGN_LABELS:
+            idx = np.flatnonzero(sign == sign_value)
+            if idx.size == 0: continue
+
+            traces.append(dict(
+                type='scattermap',
+                lat=lat[idx],
+                lon=lon[idx],
+                mode='markers',
+                marker=dict(size=markersize[idx], color=colors[idx]),
+                name=label,
+                customdata=customdata[idx],
+                **hover_fields(label, colors[idx]),
+            ))
+
+        layout = dict(
+            map=dict(
+                style="carto-positron",
+                center=dict(lat=float(lat.mean()), lon=float(lon.mean())),
+                zoom=10
+            ),
+            showlegend=False,
+            margin=dict(l=5, r=5, t=30, b=5),
+            height=600,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            title=dict(
+                text=city,
+                font=dict(family="Open Sans, sans-serif bold", size=12, color='black'),
+                x=0.5,  # Center the title
+                y=0.98
+            )
+        )
+        return dict(data=traces, layout=layout)
+
+    else:  # grid view
+        x = data['x_coord'].to_numpy()
+        y = data['y_coord'].to_numpy()
+        marker_size = data['marker_size'].to_numpy()
+        colors = data['color'].astype(str).to_numpy()
+        customdata = hover_customdata(data)
+        sign = data['sign'].to_numpy()
+
+        traces = []
+
+        for sign_value, label in SIGN_LABELS:
+            idx = np.flatnonzero(sign == sign_value)
+            if idx.size == 0: continue
+            color = colors[idx] if label != 'No Change' else '#E6E6E6'
+
+            traces.append(dict(
+                type='scatter',
+                x=x[idx],
+                y=y[idx],
+                mode='markers',
+                marker=dict(color=color, size=marker_size[idx], opacity=0.9),
+                name=label,
+                customdata=customdata[idx],
+                **hover_fields(label, color),
+            ))
+
+        layout = dict(
+            xaxis=dict(showgrid=False, showticklabels=False, zeroline=False),
+            yaxis=dict(showgrid=False, showticklabels=False, zeroline=False),
+            height=600,
+            paper_bgcolor='rgba(0,0,0,0)',
+            plot_bgcolor='rgba(0,0,0,0)',
+            showlegend=False,
+            margin=dict(l=5, r=5, t=30, b=5),
+            title=dict(
+                text=city,
+                font=dict(family="Open Sans, sans-serif", size=12, color='black'),
+                x=0.5,  # Center the title
+                y=0.98
+            )
+        )
+        return dict(data=traces, layout=layout)
+
+# Only len(cities) * 2 figures can ever be requested, so build them all up
+# front as {mode: {city: figure}}; the browser receives them via dcc.Store
+FIG_CACHE = {
+    mode: {city: make_plot(city, mode) for city in CITY_FRAMES}
+    for mode in ('map', 'grid')
+}
     
 # Custom CSS
 app.index_string = '''
@@ -112,6 +303,8 @@ app.index_string = '''
 '''
 
 app.layout = html.Div(className="container", children=[
+    dcc.Store(id='fig-cache', data=FIG_CACHE),
+
     html.Div(className="header", children=[
         html.H2("Tree Cover Change Dashboard"),
         html.Div(className="intro-text", children=[
@@ -165,130 +358,21 @@ app.layout = html.Div(className="container", children=[
     ])
 ])
 
-@app.callback(
+# Figures are swapped in the browser, so changing city or mode needs no server round-trip
+app.clientside_callback(
+    """
+    function(city1, city2, mode, cache) {
+        var figs = cache[mode] || {};
+        return [figs[city1] || {}, figs[city2] || {}];
+    }
+    """,
     Output('graph1', 'figure'),
     Output('graph2', 'figure'),
     Input('city1', 'value'),
     Input('city2', 'value'),
-    Input('view-mode', 'value')
+    Input('view-mode', 'value'),
+    State('fig-cache', 'data')
 )
-def update_graphs(city1, city2, mode):
-    fig1 = make_plot(results_gdf, city1, mode)
-    fig2 = make_plot(results_gdf, city2, mode)
-    return fig1, fig2
-
-def make_plot(df, city, mode):
-    data = df[df["location"] == city].copy()
-
-    temp = data.set_geometry('point_geom').to_crs("EPSG:4326")
-    data['lat'] = temp.geometry.y
-    data['lon'] = temp.geometry.x
-
-    if mode == 'map':
-        # Determine hover text color based on background color
-        hover_text_colors = []
-        for color in data['color']:
-            # We'll use white text for all markers for better consistency
-            hover_text_colors.append('white')
-        
-        data['hover_text_color'] = hover_text_colors
-
-        fig = go.Figure()
-        fig.add_trace(go.Scattermapbox(
-            lat=data['lat'],
-            lon=data['lon'],
-            mode='markers',
-            marker=dict(size=data['markersize'], color=data['color']),
-            name='Points',
-            customdata=data[['tree_cover_change', 'tree_cover_2002', 'tree_cover_2022', 'hover_text_color']].values,
-            hovertemplate=(
-                "<span style='color:%{customdata[3]}'>Type: " + 
-                ("Decrease" if "%{customdata[0]}" < "0" else "Increase" if "%{customdata[0]}" > "0" else "No Change") + 
-                "<br>Change: %{customdata[0]:.2f} %<br>" +
-                "2002: %{customdata[1]:.2f} %<br>" +
-                "2022: %{customdata[2]:.2f} %</span><extra></extra>"
-            ),
-            hoverlabel=dict(
-                bgcolor=data['color'],
-                bordercolor='rgba(255,255,255,1.0)',
-            )
-        ))
-        fig.update_layout(
-            mapbox=dict(
-                style="carto-positron",
-                center=dict(lat=data['lat'].mean(), lon=data['lon'].mean()),
-                zoom=10
-            ),
-            margin=dict(l=5, r=5, t=30, b=5),
-            height=600,
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            title=dict(
-                text=city,
-                font=dict(family="Open Sans, sans-serif bold", size=12, color='black'),
-                x=0.5,  # Center the title
-                y=0.98
-            )
-        )
-        return fig
-
-    else:  # grid view
-        data = data.sort_values(by="tree_cover_change")
-        n_cols = 80
-        data['x_coord'] = [i % n_cols for i in range(len(data))]
-        data['y_coord'] = [-(i // n_cols) for i in range(len(data))]
-        data['marker_size'] = data['tree_cover_change'].abs() / 2
-        data.loc[data['tree_cover_change'] == 0, 'marker_size'] = 0.1
-
-        fig = go.Figure()
-
-        for filt, label, hover_color in [
-            (data['tree_cover_change'] < 0, 'Decrease', 'Decrease'),
-            (data['tree_cover_change'] > 0, 'Increase', 'Increase'),
-            (data['tree_cover_change'] == 0, 'No Change', 'No Change')
-        ]:
-            sub = data[filt]
-            if sub.empty: continue
-            color = sub['color'] if label != 'No Change' else '#E6E6E6'
-            
-            # Add white text color for hover info
-            sub['hover_text_color'] = 'white'
-
-            fig.add_trace(go.Scatter(
-                x=sub['x_coord'],
-                y=sub['y_coord'],
-                mode='markers',
-                marker=dict(color=color, size=sub['marker_size'], opacity=0.9),
-                name=label,
-                customdata=sub[['tree_cover_change', 'tree_cover_2002', 'tree_cover_2022', 'hover_text_color']].values,
-                hovertemplate=(
-                    "<span style='color:%{customdata[3]}'>Type: " + label + "<br>" +
-                    "Change: %{customdata[0]:.2f} %<br>" +
-                    "2002: %{customdata[1]:.2f} %<br>" +
-                    "2022: %{customdata[2]:.2f} %</span><extra></extra>"
-                ),
-                hoverlabel=dict(
-                    bgcolor=color,
-                    bordercolor='rgba(255,255,255,1.0)',
-                )
-            ))
-
-        fig.update_layout(
-            xaxis=dict(showgrid=False, showticklabels=False, zeroline=False),
-            yaxis=dict(showgrid=False, showticklabels=False, zeroline=False),
-            height=600,
-            paper_bgcolor='rgba(0,0,0,0)',
-            plot_bgcolor='rgba(0,0,0,0)',
-            showlegend=False,
-            margin=dict(l=5, r=5, t=30, b=5),
-            title=dict(
-                text=city,
-                font=dict(family="Open Sans, sans-serif", size=12, color='black'),
-                x=0.5,  # Center the title
-                y=0.98
-            )
-        )
-        return fig
 
 if __name__ == "__main__":
     app.run(debug=True)
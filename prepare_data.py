@@ -0,0 +1,45 @@
+"""Flatten data/results_gdf.pkl into the geometry-free table the app loads.
+
+Run this offline whenever the source GeoDataFrame changes. It needs geopandas
+and shapely, which the app itself does not require at runtime.
+"""
+import os
+
+import pandas as pd
+import shapely
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+source_path = os.path.join(BASE_DIR, "data", "results_gdf.pkl")
+output_path = os.path.join(BASE_DIR, "data", "results.feather")
+
+# Only the columns the dashboard actually reads
+COLUMNS = [
+    "location",
+    "lat",
+    "lon",
+    "tree_cover_change",
+    "tree_cover_2002",
+    "tree_cover_2022",
+    "markersize",
+    "color",
+]
+
+
+def main():
+    results_gdf = pd.read_pickle(source_path)
+
+    # Reproject the point geometries once and flatten them to plain lat/lon
+    # floats in a single vectorized call
+    temp = results_gdf.set_geometry('point_geom').to_crs("EPSG:4326")
+    coords = shapely.get_coordinates(temp.geometry.to_numpy())
+    results_gdf['lon'] = coords[:, 0].astype('float32')
+    results_gdf['lat'] = coords[:, 1].astype('float32')
+
+    # Leave geometry and point_geom behind so the app never needs shapely
+    results_df = pd.DataFrame(results_gdf[COLUMNS]).reset_index(drop=True)
+    results_df.to_feather(output_path, compression="zstd")
+    print(f"Wrote {len(results_df)} rows to {output_path}")
+
+
+if __name__ == "__main__":
+    main()